@@ -1,7 +1,9 @@
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
-from core.models import Product, OrderItem
+from core.models import Product, OrderItem, PRODUCTS_CACHE_KEY, PRODUCT_CARDS_CACHE_VERSION
 
 
 class Command(BaseCommand):
@@ -18,9 +20,11 @@ class Command(BaseCommand):
         Execute the command to create sample products.
         
         Flow:
-        1. Upsert the 3 fixed products deterministically by name
-        2. Delete any extra products only if they are unreferenced
-        3. Display confirmation message
+        1. Return early if the 3 fixed products already match and no extras exist
+        2. Upsert the 3 fixed products deterministically by name (one statement)
+        3. Delete any extra products only if they are unreferenced
+        4. Invalidate the cached product list and product cards fragment
+        5. Display confirmation message
         """
         desired = [
             ('Laptop', 99999),   # $999.99
@@ -30,26 +34,39 @@ class Command(BaseCommand):
         desired_names = [name for (name, _) in desired]
 
         with transaction.atomic():
-            created = 0
-            updated = 0
-            for name, price_cents in desired:
-                obj, was_created = Product.objects.update_or_create(
-                    name=name,
-                    defaults={'price_cents': price_cents},
-                )
-                created += 1 if was_created else 0
-                updated += 0 if was_created else 1
-
+            existing = dict(
+                Product.objects.filter(name__in=desired_names).values_list('name', 'price_cents')
+            )
             # Keep DB tidy without breaking existing orders:
-            # delete products not in our fixed set only if unreferenced.
+            # products not in our fixed set are extras only if unreferenced.
             referenced_ids = OrderItem.objects.values_list('product_id', flat=True).distinct()
-            deleted, _ = (
+            extras = (
                 Product.objects
                 .exclude(name__in=desired_names)
                 .exclude(id__in=referenced_ids)
-                .delete()
             )
 
+            # Fast path (the usual re-seed): rows already match and nothing to clean up.
+            if existing == dict(desired) and not extras.exists():
+                self.stdout.write(self.style.SUCCESS('Products already seeded. Nothing to do.'))
+                return
+
+            created = len(set(desired_names) - existing.keys())
+            updated = len(existing)
+
+            # Single INSERT ... ON CONFLICT (name) DO UPDATE for all fixed products.
+            Product.objects.bulk_create(
+                [Product(name=name, price_cents=price_cents) for (name, price_cents) in desired],
+                update_conflicts=True,
+                unique_fields=['name'],
+                update_fields=['price_cents'],
+            )
+
+            deleted, _ = extras.delete()
+
+        # Drop the cached product list and rendered cards so the home page and checkout see the new rows.
+        cache.delete_many([PRODUCTS_CACHE_KEY, make_template_fragment_key('product_cards', [PRODUCT_CARDS_CACHE_VERSION])])
+
         self.stdout.write(
             self.style.SUCCESS(
                 f'Products seeded. created={created}, updated={updated}, deleted_extra_unreferenced={deleted}'
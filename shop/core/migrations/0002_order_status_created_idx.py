@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-15 21:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', '-created_at'], name='order_status_created_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-15 21:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_order_status_created_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='name',
+            field=models.CharField(max_length=255, unique=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-15 21:12
+
+from django.db import migrations, models
+
+
+# Old string status -> new integer status.
+STATUS_MAP = {'PENDING': 0, 'PAID': 1, 'FAILED': 2}
+
+
+def status_codes_to_ints(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    for code, value in STATUS_MAP.items():
+        Order.objects.filter(status=code).update(status=str(value))
+
+
+def status_ints_to_codes(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    for code, value in STATUS_MAP.items():
+        Order.objects.filter(status=str(value)).update(status=code)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_product_name_unique'),
+    ]
+
+    operations = [
+        # Rewrite the stored values while the column is still text, then change its type.
+        migrations.RunPython(status_codes_to_ints, status_ints_to_codes),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.SmallIntegerField(choices=[(0, 'Pending'), (1, 'Paid'), (2, 'Failed')], default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-15 21:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_order_status_smallint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+    ]
@@ -1,20 +1,35 @@
 from django.db import models
 
+# Cache key for the fixed product list (bump the version if the cached shape changes).
+PRODUCTS_CACHE_KEY = 'core:products:v1'
+PRODUCTS_CACHE_TIMEOUT = 60 * 60
+# Vary-on for the product_cards template fragment (bump when the card markup changes).
+PRODUCT_CARDS_CACHE_VERSION = 'v1'
+
+
+def format_cents(cents):
+    """Format an amount in cents as dollars, e.g. 99999 -> '999.99' (integer math, no floats)."""
+    return f"{cents // 100}.{cents % 100:02d}"
+
 
 class Product(models.Model):
     """
     Product model representing items available for purchase.
     
     Fields:
-    - name: Product name
+    - name: Product name (UNIQUE; the seed command upserts by name)
     - price_cents: Price in cents (to avoid floating point issues)
     """
-    name = models.CharField(max_length=255)
+    name = models.CharField(max_length=255, unique=True)
     price_cents = models.IntegerField()  # Price in cents
     
     class Meta:
         ordering = ['id']
     
+    @property
+    def price_display(self):
+        return format_cents(self.price_cents)
+    
     def __str__(self):
         return self.name
 
@@ -25,13 +40,14 @@ class Order(models.Model):
     
     Fields:
     - session_id: Stripe checkout session ID (UNIQUE)
-    - status: Order status (PENDING, PAID, FAILED)
+    - idempotency_key: Client-generated key for one cart submission (UNIQUE, optional)
+    - status: Order status (PENDING, PAID, FAILED), stored as a small integer
     - total_cents: Total order amount in cents
     - created_at: Order creation timestamp
     """
-    STATUS_PENDING = 'PENDING'
-    STATUS_PAID = 'PAID'
-    STATUS_FAILED = 'FAILED'
+    STATUS_PENDING = 0
+    STATUS_PAID = 1
+    STATUS_FAILED = 2
     
     STATUS_CHOICES = [
         (STATUS_PENDING, 'Pending'),
@@ -39,16 +55,36 @@ class Order(models.Model):
         (STATUS_FAILED, 'Failed'),
     ]
     
+    # Status codes exposed to the frontend (JSON API and templates).
+    STATUS_CODES = {
+        STATUS_PENDING: 'PENDING',
+        STATUS_PAID: 'PAID',
+        STATUS_FAILED: 'FAILED',
+    }
+    
     session_id = models.CharField(max_length=255, unique=True)
-    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    status = models.SmallIntegerField(choices=STATUS_CHOICES, default=STATUS_PENDING)
     total_cents = models.IntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Serves the home page's "PAID orders, newest first" listing.
+            models.Index(fields=['status', '-created_at'], name='order_status_created_idx'),
+        ]
+    
+    @property
+    def status_code(self):
+        return self.STATUS_CODES[self.status]
+    
+    @property
+    def total_display(self):
+        return format_cents(self.total_cents)
     
     def __str__(self):
-        return f"Order {self.id} - {self.status}"
+        return f"Order {self.id} - {self.status_code}"
 
 
 class OrderItem(models.Model):
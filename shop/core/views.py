@@ -1,20 +1,75 @@
-import json
+import hashlib
+import orjson
 import stripe
 import logging
 import uuid
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import HttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
 from django.db import transaction, IntegrityError
+from django.db.models import Prefetch
 
-from .models import Product, Order, OrderItem
+from .models import (
+    Product, Order, OrderItem,
+    PRODUCTS_CACHE_KEY, PRODUCTS_CACHE_TIMEOUT, PRODUCT_CARDS_CACHE_VERSION,
+)
 
 logger = logging.getLogger(__name__)
 
+# Stripe settings come from the environment and are fixed per process; read them once at import.
+_STRIPE_KEY_PRESENT = settings.STRIPE_KEY_PRESENT
+_DEMO_MODE = settings.STRIPE_DEMO_MODE or not _STRIPE_KEY_PRESENT  # Demo is ONLY a fallback.
+_WEBHOOK_SECRET = settings.STRIPE_WEBHOOK_SECRET
+
+# Stripe part of the index() template context; constant per process, so built once.
+_STRIPE_TEMPLATE_CONTEXT = {
+    'stripe_public_key': settings.STRIPE_PUBLISHABLE_KEY if _STRIPE_KEY_PRESENT else 'pk_demo_mode',
+    'stripe_configured': _STRIPE_KEY_PRESENT,
+    'demo_mode': _DEMO_MODE,
+}
+
 # Initialize Stripe API key (real mode when keys exist)
-stripe.api_key = settings.STRIPE_SECRET_KEY if settings.STRIPE_KEY_PRESENT else None
+stripe.api_key = settings.STRIPE_SECRET_KEY if _STRIPE_KEY_PRESENT else None
+
+# PAID orders shown per page on the home page.
+ORDERS_PER_PAGE = 25
+
+# Per-product quantity limit; matches the UI's clampInt(0, 99).
+MAX_QUANTITY = 99
+
+# order_status polling cache: short TTL while PENDING, longer once the webhook has finalized it.
+# Keyed by a hash of the session_id so client-supplied values are always valid cache keys (memcached).
+ORDER_STATUS_CACHE_KEY = 'core:order-status:{}'
+ORDER_STATUS_PENDING_TIMEOUT = 2
+ORDER_STATUS_FINAL_TIMEOUT = 5 * 60
+
+
+def _json_response(data, status=200):
+    """JsonResponse equivalent serialized with orjson (faster than the stdlib encoder)."""
+    return HttpResponse(orjson.dumps(data), content_type='application/json', status=status)
+
+
+def _order_status_cache_key(session_id):
+    """Cache key for a session_id's order status (fixed length, safe characters)."""
+    return ORDER_STATUS_CACHE_KEY.format(hashlib.sha256(session_id.encode()).hexdigest())
+
+
+def _fixed_products():
+    """
+    Return the 3 fixed products (seeded deterministically).
+
+    Products only change when seed_products runs, which deletes the cache key,
+    so page loads and checkouts read them from the cache instead of the database.
+    """
+    return cache.get_or_set(
+        PRODUCTS_CACHE_KEY,
+        lambda: list(Product.objects.order_by('id')[:3]),
+        PRODUCTS_CACHE_TIMEOUT,
+    )
 
 
 @ensure_csrf_cookie
@@ -23,32 +78,33 @@ def index(request):
     Display the home page with product list and order history.
     
     Flow:
-    1. Fetch all products from database
-    2. Fetch PAID orders only
+    1. Fetch the fixed products (cached)
+    2. Fetch one page of PAID orders only
     3. Render index.html with products and orders
     4. Determine Stripe mode based on key presence
     """
     # Display exactly 3 fixed products (seeded deterministically).
-    products = list(Product.objects.order_by('id')[:3])
-    for p in products:
-        p.price_display = f"{p.price_cents / 100:.2f}"
+    products = _fixed_products()
 
-    paid_orders = list(
-        Order.objects.filter(status=Order.STATUS_PAID).prefetch_related('items__product')
+    # Items + product names are fetched in one JOIN, limited to the columns rendered.
+    items_qs = OrderItem.objects.select_related('product').only(
+        'order', 'product', 'quantity', 'product__name'
     )
-    for o in paid_orders:
-        o.total_display = f"{o.total_cents / 100:.2f}"
-    
-    # Stripe mode is determined by key presence
-    stripe_configured = settings.STRIPE_KEY_PRESENT
-    demo_mode = settings.STRIPE_DEMO_MODE
+    paid_orders = (
+        Order.objects
+        .filter(status=Order.STATUS_PAID)
+        .only('id', 'status', 'total_cents', 'created_at')
+        .prefetch_related(Prefetch('items', queryset=items_qs))
+    )
+    # LIMIT/OFFSET in SQL; the prefetch only runs for the orders on this page.
+    orders_page = Paginator(paid_orders, ORDERS_PER_PAGE).get_page(request.GET.get('page'))
     
+    # Stripe mode is determined by key presence (fixed at import)
     return render(request, 'core/index.html', {
+        **_STRIPE_TEMPLATE_CONTEXT,
         'products': products,
-        'orders': paid_orders,
-        'stripe_public_key': settings.STRIPE_PUBLISHABLE_KEY if stripe_configured else 'pk_demo_mode',
-        'stripe_configured': stripe_configured,
-        'demo_mode': demo_mode,
+        'product_cards_version': PRODUCT_CARDS_CACHE_VERSION,
+        'orders': orders_page,
     })
 
 
@@ -58,55 +114,120 @@ def create_checkout_session(request):
     Create a Stripe checkout session for the cart.
     
     Flow:
-    1. Parse cart items from request body (JSON)
-    2. Validate products exist and quantities are positive
+    1. Parse cart items and the client's idempotency_key from request body (JSON)
+    2. Validate products exist and quantities are within 0..MAX_QUANTITY per product
     3. Calculate total in cents
-    4. Create Stripe checkout session (test mode) OR demo session
-    5. Create Order with status=PENDING and session_id from Stripe
-    6. Create OrderItem rows for each product
-    7. Return session ID (frontend redirects to Stripe)
+    4. If an Order already exists for the idempotency_key, return its session ID (retry)
+       when it holds the same cart, else 409
+    5. Create Stripe checkout session (test mode, same idempotency key) OR demo session
+    6. Create Order with status=PENDING, session_id from Stripe and the idempotency_key
+    7. Create OrderItem rows for each product
+    8. Return session ID (frontend redirects to Stripe)
     
     Error Handling:
-    - Return 400 if product not found or invalid quantity
+    - Return 400 if product not found, invalid quantity or invalid idempotency_key
+    - Return 409 if the idempotency_key was used for a different cart
+    - Return 409 if the session or idempotency_key was already recorded concurrently
     - Return 500 if Stripe API fails
+    - Anything unexpected propagates to Django's 500 handling (logged, no details leaked)
     """
     try:
-        data = json.loads(request.body)
+        data = orjson.loads(request.body)
+        if not isinstance(data, dict):
+            return _json_response({'error': 'Invalid JSON'}, status=400)
         items = data.get('items', [])
-        
+        idempotency_key = data.get('idempotency_key')
+
+        if idempotency_key is not None and not (
+            isinstance(idempotency_key, str) and 0 < len(idempotency_key) <= 255
+        ):
+            return _json_response({'error': 'Invalid idempotency_key'}, status=400)
+
         if not items:
-            return JsonResponse({'error': 'No items in cart'}, status=400)
+            return _json_response({'error': 'No items in cart'}, status=400)
+        if not isinstance(items, list):
+            return _json_response({'error': 'Invalid items'}, status=400)
         
         # Allow only the 3 fixed products displayed on the page.
-        allowed_products = list(Product.objects.order_by('id')[:3])
-        allowed_by_id = {p.id: p for p in allowed_products}
+        allowed_by_id = {p.id: p for p in _fixed_products()}
 
-        # Validate and collect line items for Stripe/demo
-        line_items = []
-        total_cents = 0
-        order_items = []
+        # Validate cart rows, merging quantities of repeated products (first-seen order kept).
+        quantities = {}
         
         for item in items:
+            if not isinstance(item, dict):
+                return _json_response({'error': 'Invalid items'}, status=400)
             product_id = item.get('product_id')
             quantity = item.get('quantity', 0)
             
             if not isinstance(product_id, int):
-                return JsonResponse({'error': 'Invalid product_id'}, status=400)
-            if not isinstance(quantity, int) or quantity < 0:
-                return JsonResponse({'error': f'Invalid quantity for product {product_id}'}, status=400)
+                return _json_response({'error': 'Invalid product_id'}, status=400)
+            if not isinstance(quantity, int) or not 0 <= quantity <= MAX_QUANTITY:
+                return _json_response({'error': f'Invalid quantity for product {product_id}'}, status=400)
             if quantity == 0:
                 continue
 
             product = allowed_by_id.get(product_id)
             if product is None:
-                return JsonResponse({'error': f'Product {product_id} not found'}, status=400)
-            
-            # Calculate cost
-            item_total = product.price_cents * quantity
-            total_cents += item_total
+                return _json_response({'error': f'Product {product_id} not found'}, status=400)
             
-            # Add to line items (for both Stripe and demo)
-            line_items.append({
+            quantity += quantities.get(product_id, 0)
+            if quantity > MAX_QUANTITY:
+                return _json_response({'error': f'Invalid quantity for product {product_id}'}, status=400)
+            quantities[product_id] = quantity
+
+        # One (product, quantity) pair per product: one Stripe line item and one OrderItem row each.
+        order_items = [(allowed_by_id[pid], qty) for (pid, qty) in quantities.items()]
+
+        if not order_items:
+            return _json_response({'error': 'Please select at least one item'}, status=400)
+
+        # Calculate cost from validated pairs.
+        total_cents = sum(product.price_cents * qty for (product, qty) in order_items)
+
+        # Retried submit of the same cart: hand back the session created the first time,
+        # without another Stripe API call. A different cart under a used key is rejected.
+        if idempotency_key:
+            existing = (
+                Order.objects
+                .filter(idempotency_key=idempotency_key)
+                .only('id', 'session_id', 'total_cents')
+                .first()
+            )
+            if existing is not None:
+                if (
+                    existing.total_cents != total_cents
+                    or dict(existing.items.values_list('product_id', 'quantity')) != quantities
+                ):
+                    return _json_response(
+                        {'error': 'idempotency_key was already used for a different cart'},
+                        status=409,
+                    )
+                return _json_response({'sessionId': existing.session_id, 'demo': _DEMO_MODE})
+        
+        # Check if Stripe is configured based on key presence flag from settings
+        if _DEMO_MODE:
+            # Demo mode (fallback only): create order as PAID immediately (no Stripe call).
+            demo_session_id = f"demo_{uuid.uuid4().hex}"
+            try:
+                with transaction.atomic():
+                    order = Order.objects.create(
+                        session_id=demo_session_id,
+                        idempotency_key=idempotency_key,
+                        status=Order.STATUS_PAID,
+                        total_cents=total_cents,
+                    )
+                    OrderItem.objects.bulk_create([
+                        OrderItem(order=order, product=product, quantity=qty)
+                        for (product, qty) in order_items
+                    ])
+            except IntegrityError:
+                return _json_response({'error': 'Duplicate checkout session. Please retry.'}, status=409)
+            return _json_response({'sessionId': order.session_id, 'demo': True})
+
+        # Real Stripe mode: build line items (only Stripe needs them) and create the checkout session
+        line_items = [
+            {
                 'price_data': {
                     'currency': 'usd',
                     'product_data': {
@@ -114,31 +235,10 @@ def create_checkout_session(request):
                     },
                     'unit_amount': product.price_cents,
                 },
-                'quantity': quantity,
-            })
-            
-            order_items.append((product, quantity))
-
-        if not line_items:
-            return JsonResponse({'error': 'Please select at least one item'}, status=400)
-        
-        # Check if Stripe is configured based on key presence flag from settings
-        if settings.STRIPE_DEMO_MODE or not settings.STRIPE_KEY_PRESENT:
-            # Demo mode (fallback only): create order as PAID immediately (no Stripe call).
-            demo_session_id = f"demo_{uuid.uuid4().hex}"
-            with transaction.atomic():
-                order = Order.objects.create(
-                    session_id=demo_session_id,
-                    status=Order.STATUS_PAID,
-                    total_cents=total_cents,
-                )
-                OrderItem.objects.bulk_create([
-                    OrderItem(order=order, product=product, quantity=qty)
-                    for (product, qty) in order_items
-                ])
-            return JsonResponse({'sessionId': order.session_id, 'demo': True})
-
-        # Real Stripe mode: Create Stripe checkout session
+                'quantity': qty,
+            }
+            for (product, qty) in order_items
+        ]
         try:
             session = stripe.checkout.Session.create(
                 payment_method_types=['card'],
@@ -147,20 +247,23 @@ def create_checkout_session(request):
                 # Redirect is NOT used to mark orders paid; webhook is the only source of truth.
                 success_url=request.build_absolute_uri('/') + '?success=1&session_id={CHECKOUT_SESSION_ID}',
                 cancel_url=request.build_absolute_uri('/') + '?canceled=1',
+                # Stripe returns the same session if this key was already used (e.g. a lost response).
+                idempotency_key=idempotency_key,
             )
         except stripe.error.AuthenticationError:
-            return JsonResponse(
+            return _json_response(
                 {'error': 'Stripe API key is invalid. Please configure STRIPE_SECRET_KEY.'},
                 status=500,
             )
         except stripe.error.StripeError as e:
-            return JsonResponse({'error': f'Stripe error: {str(e)}'}, status=500)
+            return _json_response({'error': f'Stripe error: {str(e)}'}, status=500)
 
         # Atomic DB writes: create Order + OrderItems together.
         try:
             with transaction.atomic():
                 order = Order.objects.create(
                     session_id=session.id,
+                    idempotency_key=idempotency_key,
                     status=Order.STATUS_PENDING,
                     total_cents=total_cents,
                 )
@@ -169,16 +272,39 @@ def create_checkout_session(request):
                     for (product, qty) in order_items
                 ])
         except IntegrityError:
-            return JsonResponse({'error': 'Duplicate checkout session. Please retry.'}, status=409)
+            return _json_response({'error': 'Duplicate checkout session. Please retry.'}, status=409)
 
-        return JsonResponse({'sessionId': session.id})
+        return _json_response({'sessionId': session.id})
     
-    except json.JSONDecodeError:
-        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except orjson.JSONDecodeError:
+        return _json_response({'error': 'Invalid JSON'}, status=400)
     except stripe.error.StripeError as e:
-        return JsonResponse({'error': f'Stripe error: {str(e)}'}, status=500)
-    except Exception as e:
-        return JsonResponse({'error': f'Server error: {str(e)}'}, status=500)
+        return _json_response({'error': f'Stripe error: {str(e)}'}, status=500)
+
+
+def _handle_checkout_session_completed(session):
+    """Mark the Order for a completed Checkout Session as PAID (idempotent)."""
+    session_id = session['id']
+
+    # Single conditional UPDATE: atomic, and a no-op when the order is already PAID.
+    updated = (
+        Order.objects
+        .filter(session_id=session_id)
+        .exclude(status=Order.STATUS_PAID)
+        .update(status=Order.STATUS_PAID)
+    )
+    if updated:
+        # Polling clients see PAID immediately instead of waiting out a cached PENDING.
+        cache.set(_order_status_cache_key(session_id), Order.STATUS_PAID, ORDER_STATUS_FINAL_TIMEOUT)
+    elif not Order.objects.filter(session_id=session_id).exists():
+        # Don't ask Stripe to retry forever; log for investigation.
+        logger.warning('Webhook for unknown session_id=%s', session_id)
+
+
+# Stripe event type -> handler for the event's data.object. Other types are acknowledged and ignored.
+_WEBHOOK_HANDLERS = {
+    'checkout.session.completed': _handle_checkout_session_completed,
+}
 
 
 @csrf_exempt
@@ -190,55 +316,38 @@ def stripe_webhook(request):
     Flow:
     1. Verify webhook signature from request headers using Stripe library
     2. Parse JSON payload from request body
-    3. Check event type for 'checkout.session.completed'
-    4. Extract session_id from event
-    5. Fetch Order by session_id
-    6. If Order status is already PAID, return 200 (idempotent)
-    7. Else update Order status to PAID
-    8. Return 200 response to Stripe
+    3. Look up the handler for the event type; unhandled types return 200 with no DB work
+    4. 'checkout.session.completed': mark the Order PAID with one conditional UPDATE
+       (skips orders already PAID; logs session_ids with no Order)
+    5. Return 200 response to Stripe
     
     Safety:
     - Uses unique session_id to prevent double charges
-    - Idempotent: checking existing PAID status prevents re-processing
+    - Idempotent: the UPDATE only matches orders not yet PAID, so replays are no-ops
     - Webhook only source of truth for payment (never via redirect)
     """
-    if not settings.STRIPE_WEBHOOK_SECRET:
+    if not _WEBHOOK_SECRET:
         logger.error('STRIPE_WEBHOOK_SECRET is not configured.')
-        return JsonResponse({'error': 'Webhook secret not configured'}, status=500)
+        return _json_response({'error': 'Webhook secret not configured'}, status=500)
 
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
     
     try:
         event = stripe.Webhook.construct_event(
-            payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
+            payload, sig_header, _WEBHOOK_SECRET
         )
     except ValueError:
-        return JsonResponse({'error': 'Invalid payload'}, status=400)
+        return _json_response({'error': 'Invalid payload'}, status=400)
     except stripe.error.SignatureVerificationError:
-        return JsonResponse({'error': 'Invalid signature'}, status=400)
+        return _json_response({'error': 'Invalid signature'}, status=400)
     
-    # Handle checkout.session.completed event
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        session_id = session['id']
-        
-        try:
-            with transaction.atomic():
-                order = Order.objects.select_for_update().get(session_id=session_id)
-
-                # Idempotent: if already PAID, return 200
-                if order.status == Order.STATUS_PAID:
-                    return JsonResponse({'status': 'success'})
-
-                order.status = Order.STATUS_PAID
-                order.save(update_fields=['status'])
-        except Order.DoesNotExist:
-            # Don't ask Stripe to retry forever; log for investigation.
-            logger.warning('Webhook for unknown session_id=%s', session_id)
-            return JsonResponse({'status': 'success'})
-    
-    return JsonResponse({'status': 'success'})
+    handler = _WEBHOOK_HANDLERS.get(event['type'])
+    if handler is None:
+        return _json_response({'status': 'ignored'})
+
+    handler(event['data']['object'])
+    return _json_response({'status': 'success'})
 
 
 @require_http_methods(["GET"])
@@ -247,15 +356,26 @@ def order_status(request):
     Read-only endpoint used by the frontend after Stripe redirect.
 
     This does NOT mark anything as PAID; it only reports what the webhook has finalized.
+    Results are cached briefly (the webhook overwrites the entry on PAID), so repeated
+    polls mostly skip the database.
     """
     session_id = request.GET.get('session_id', '')
     if not session_id:
-        return JsonResponse({'error': 'Missing session_id'}, status=400)
+        return _json_response({'error': 'Missing session_id'}, status=400)
+    if len(session_id) > Order._meta.get_field('session_id').max_length or not session_id.isprintable():
+        return _json_response({'error': 'Invalid session_id'}, status=400)
 
-    try:
-        order = Order.objects.only('status').get(session_id=session_id)
-    except Order.DoesNotExist:
-        # Session exists at Stripe but order creation could have failed; treat as pending.
-        return JsonResponse({'status': 'PENDING'})
+    cache_key = _order_status_cache_key(session_id)
+    status = cache.get(cache_key)
+    if status is None:
+        # Read the one column as a plain value; no model instance is built.
+        status = Order.objects.filter(session_id=session_id).values_list('status', flat=True).first()
+        if status is None:
+            # Session exists at Stripe but order creation could have failed; treat as pending.
+            status = Order.STATUS_PENDING
+        timeout = (
+            ORDER_STATUS_PENDING_TIMEOUT if status == Order.STATUS_PENDING else ORDER_STATUS_FINAL_TIMEOUT
+        )
+        cache.set(cache_key, status, timeout)
 
-    return JsonResponse({'status': order.status})
+    return _json_response({'status': Order.STATUS_CODES[status]})